@@ -1,11 +1,27 @@
-import base64
+import argparse
+import asyncio
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
 from email.mime.text import MIMEText
+from email.utils import formataddr, parseaddr
+import httplib2
+from google.auth.exceptions import TransportError
 from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp, Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+# pybase64 is an optional SIMD-accelerated drop-in for the stdlib base64 module
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 # Google API scopes (only Gmail.modify is needed for sending replies)
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
@@ -17,11 +33,76 @@ ACKNOWLEDGMENT_MESSAGE = (
     "Best regards,\nAssistant Agent (mail-id-2)"
 )
 
+# The acknowledgment body never changes, so its MIME headers and encoded body are serialized once;
+# each reply only prepends its own To/Subject/threading headers to these bytes. Auto-Submitted (RFC 3834)
+# marks the reply as automatic so other auto-responders do not answer it back
+ACK_TEMPLATE = b"Auto-Submitted: auto-replied\n" + MIMEText(ACKNOWLEDGMENT_MESSAGE).as_bytes()
+
+# Unread mail worth acknowledging; filtering happens server-side so skipped mail is never listed.
+# An optional newer_than window (e.g. '1d') narrows it further, but unread mail older than the window,
+# such as a backlog after downtime or failed sends awaiting retry, is then never acknowledged
+UNREAD_QUERY = 'is:unread -category:promotions'
+# Largest page size messages.list accepts
+LIST_PAGE_SIZE = 500
+
+# Only these headers are needed, so the message body is never downloaded: the ones that build a threaded reply,
+# plus the ones that identify automated mail (auto-replies, mailing lists, bounces) that must not be answered
+METADATA_HEADERS = ['From', 'Subject', 'Message-ID', 'Auto-Submitted', 'Precedence', 'List-Id', 'Return-Path']
+# Precedence values used by bulk mail, mailing lists and auto-responders
+AUTOMATED_PRECEDENCE = frozenset({'bulk', 'junk', 'list', 'auto_reply'})
+# Lowercased names to match against, since senders' mail clients vary header-name casing
+REPLY_HEADERS = frozenset(name.lower() for name in METADATA_HEADERS)
+# Partial-response mask that drops labels, snippet and size fields from each fetched email
+MESSAGE_FIELDS = 'id,threadId,payload/headers'
+
+# Maximum number of calls Gmail accepts in a single batch HTTP request
+BATCH_SIZE = 50
+# Maximum number of ids messages.batchModify accepts in one call
+MODIFY_BATCH_SIZE = 1000
+
+# Maximum number of Gmail requests in flight at once, to stay under the per-user QPS limit;
+# also the size of the worker thread pool, so at most this many keep-alive transports are opened
+MAX_CONCURRENCY = 10
+GMAIL_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENCY)
+
+# Seconds to wait between inbox polls when running as a long-lived daemon
+POLL_INTERVAL = 60
+
+# Socket timeout in seconds, so a stalled connection cannot hang the run
+HTTP_TIMEOUT = 30
+# Each worker thread keeps one keep-alive transport, since httplib2.Http is not thread-safe
+_thread_local = threading.local()
+
+# Transient Gmail errors worth retrying with exponential backoff (base * 2^n seconds, capped, plus jitter).
+# Rate limits mean the request was rejected and are always safe to retry; a server error may still have been
+# applied, so it is only retried for methods that are safe to repeat
+RATE_LIMIT_STATUS = 429
+SERVER_ERROR_STATUSES = (500, 502, 503)
+NON_IDEMPOTENT_METHODS = frozenset({'gmail.users.messages.send'})
+# Dropped connections, timeouts and DNS failures are retried the same way; a non-idempotent request is only
+# retried on the errors that mean it never reached the server
+TRANSPORT_ERRORS = (OSError, httplib2.HttpLib2Error, TransportError)
+UNSENT_TRANSPORT_ERRORS = (ConnectionRefusedError, httplib2.ServerNotFoundError)
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+MAX_RETRIES = 8
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 32
+
+# Gmail's per-user quota, in quota units per second, and the unit cost of each method this script calls
+QUOTA_UNITS_PER_SECOND = 250
+QUOTA_UNITS = {
+    'gmail.users.messages.list': 5,
+    'gmail.users.messages.get': 5,
+    'gmail.users.messages.send': 100,
+    'gmail.users.messages.batchModify': 50,
+}
+DEFAULT_QUOTA_UNITS = 5
+
 # Block 1: Authentication Function
 # This function authenticates the script using credentials.json for mail-id-2
 # to send replies from mail-id-2.
-def get_gmail_service():
-    """Authenticate and return a Gmail service instance for mail-id-2."""
+def get_credentials():
+    """Authenticate and return OAuth credentials for mail-id-2."""
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -30,80 +111,322 @@ def get_gmail_service():
         creds = flow.run_local_server(port=0)  # Opens browser for OAuth consent from mail-id-2
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
-    return build('gmail', 'v1', credentials=creds)
+    return creds
+
+def refresh_credentials(creds):
+    """Refresh mail-id-2's access token only once it has expired, saving it back to token.json."""
+    if creds.expired and creds.refresh_token:
+        creds.refresh(Request(httplib2.Http(timeout=HTTP_TIMEOUT)))
+        with open('token.json', 'w') as token:
+            token.write(creds.to_json())
+
+def get_authorized_http(creds):
+    """Return the calling thread's authorized keep-alive transport, creating it on first use."""
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        _thread_local.http = http
+    return http
+
+def get_gmail_service(creds):
+    """Return a Gmail service instance for mail-id-2."""
+    return build('gmail', 'v1', http=get_authorized_http(creds), cache_discovery=False)
+
+# Block 2: Request Execution Functions
+# These functions admit each Gmail request through a client-side token bucket sized to the per-user quota,
+# and retry transient Gmail errors (rate limits, server errors and dropped connections) with exponential backoff,
+# honoring Retry-After when the server sends it.
+class TokenBucket:
+    """Thread-safe token bucket that blocks callers until enough quota units are available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """Take cost tokens from the bucket, sleeping until they have been refilled."""
+        # A request costlier than the whole bucket would otherwise wait forever
+        cost = min(cost, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait = (cost - self.tokens) / self.rate
+            time.sleep(wait)
+
+GMAIL_QUOTA = TokenBucket(QUOTA_UNITS_PER_SECOND, QUOTA_UNITS_PER_SECOND)
+
+def quota_cost(request):
+    """Return the Gmail quota units a single API request consumes."""
+    return QUOTA_UNITS.get(getattr(request, 'methodId', None), DEFAULT_QUOTA_UNITS)
+
+def is_idempotent(request):
+    """Return True if the request can be repeated without side effects (batches only bundle gets)."""
+    return getattr(request, 'methodId', None) not in NON_IDEMPOTENT_METHODS
+
+def is_retryable(error, idempotent=True):
+    """Return True if the HttpError is a rate limit, or a transient server error on an idempotent request."""
+    status = error.resp.status
+    if status == RATE_LIMIT_STATUS or (idempotent and status in SERVER_ERROR_STATUSES):
+        return True
+    # Gmail also reports quota exhaustion as 403 with a rate limit reason
+    return status == 403 and any(reason.encode() in error.content for reason in RATE_LIMIT_REASONS)
+
+def backoff_delay(attempt, error=None):
+    """Return how long to wait before the given retry attempt."""
+    retry_after = error.resp.get('retry-after') if error is not None else None
+    if retry_after and retry_after.isdigit():
+        return int(retry_after)
+    return min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) + random.uniform(0, BACKOFF_BASE)
+
+def execute_with_retry(request, max_retries=MAX_RETRIES, http=None, cost=DEFAULT_QUOTA_UNITS):
+    """Execute a Gmail API request within the quota, retrying transient errors with exponential backoff."""
+    idempotent = is_idempotent(request)
+    for attempt in range(max_retries + 1):
+        GMAIL_QUOTA.acquire(cost)
+        try:
+            return request.execute(http=http)
+        except HttpError as e:
+            if attempt == max_retries or not is_retryable(e, idempotent):
+                raise
+            time.sleep(backoff_delay(attempt, e))
+        except TRANSPORT_ERRORS as e:
+            if attempt == max_retries or not (idempotent or isinstance(e, UNSENT_TRANSPORT_ERRORS)):
+                raise
+            time.sleep(backoff_delay(attempt))
+
+def execute_on_worker(request, creds, cost):
+    """Execute a Gmail API request with retries over the worker thread's own transport."""
+    return execute_with_retry(request, http=get_authorized_http(creds), cost=cost)
 
-# Block 2: Fetch Unread Emails Function
-# This function retrieves all unread emails from the inbox of mail-id-1.
-def get_unread_emails(gmail_service):
-    """Fetch a list of unread email messages from mail-id-1's inbox."""
+# This function runs a blocking Gmail API request on a worker thread so several requests can be in flight.
+# The service's shared httplib2 transport is not thread-safe, so each worker thread reuses its own transport.
+async def execute_async(request, creds, cost=None):
+    """Execute a Gmail API request (or batch) off the event loop and return its response."""
+    # Batches must pass their cost explicitly: the sum of the quota units of the requests they bundle
+    if cost is None:
+        cost = quota_cost(request)
+    async with GMAIL_SEMAPHORE:
+        return await asyncio.to_thread(execute_on_worker, request, creds, cost)
+
+# Block 3: Fetch Unread Emails Function
+# This function retrieves all unread emails from the inbox of mail-id-1, following every result page.
+async def get_unread_emails(gmail_service, creds, newer_than=None):
+    """Fetch a list of unread email messages from mail-id-1's inbox, optionally only those within newer_than."""
+    messages = []
+    query = f"{UNREAD_QUERY} newer_than:{newer_than}" if newer_than else UNREAD_QUERY
     try:
         # Use mail-id-1's email address to monitor its inbox
-        result = gmail_service.users().messages().list(userId='me', labelIds=['INBOX'], q='is:unread').execute()
-        messages = result.get('messages', [])
-        return messages
+        request = gmail_service.users().messages().list(
+            userId='me', labelIds=['INBOX'], q=query, maxResults=LIST_PAGE_SIZE,
+            fields='messages/id,nextPageToken')
+        while request is not None:
+            result = await execute_async(request, creds)
+            messages.extend(result.get('messages', []))
+            request = gmail_service.users().messages().list_next(request, result)
     except HttpError as e:
         print(f"Error fetching unread emails from mail-id-1: {e}")
-        return []
+    return messages
 
-# Block 3: Send Acknowledgment Reply Function
-# This function sends an acknowledgment reply from mail-id-2 to the sender within the same thread.
-def send_acknowledgment_reply(gmail_service, message):
-    """Send an acknowledgment reply from mail-id-2 to the sender within the same thread."""
-    msg_id = message['id']
-    try:
-        full_msg = gmail_service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-    except HttpError as e:
-        print(f"Error retrieving email {msg_id} from mail-id-1: {e}")
-        return
+# Block 4: Batch Fetch Emails Function
+# This function retrieves the reply headers of each unread email from mail-id-1, bundling up to
+# BATCH_SIZE messages.get calls into a single HTTP request via Gmail's batch endpoint.
+async def fetch_messages(gmail_service, creds, messages):
+    """Fetch email headers from mail-id-1 in batches, returned as a dict keyed by message id."""
+    fetched = {}
+
+    async def fetch_batch(chunk):
+        pending = chunk
+        for attempt in range(MAX_RETRIES + 1):
+            # Rate-limited gets inside a batch fail individually, so they are collected and re-batched
+            rate_limited = []
+
+            def on_message(request_id, response, exception):
+                if exception is None:
+                    fetched[request_id] = response
+                elif isinstance(exception, HttpError) and is_retryable(exception) and attempt < MAX_RETRIES:
+                    rate_limited.append({'id': request_id})
+                else:
+                    print(f"Error retrieving email {request_id} from mail-id-1: {exception}")
 
+            batch = gmail_service.new_batch_http_request(callback=on_message)
+            cost = 0
+            for message in pending:
+                request = gmail_service.users().messages().get(
+                    userId='me', id=message['id'], format='metadata',
+                    metadataHeaders=METADATA_HEADERS, fields=MESSAGE_FIELDS)
+                batch.add(request, request_id=message['id'])
+                cost += quota_cost(request)
+            try:
+                await execute_async(batch, creds, cost=cost)
+            except HttpError as e:
+                print(f"Error retrieving batch of emails from mail-id-1: {e}")
+                return
+            if not rate_limited:
+                return
+            pending = rate_limited
+            await asyncio.sleep(backoff_delay(attempt))
+
+    await asyncio.gather(*[fetch_batch(messages[start:start + BATCH_SIZE])
+                           for start in range(0, len(messages), BATCH_SIZE)])
+    return fetched
+
+# Block 5: Send Acknowledgment Reply Functions
+# These functions build the raw reply on top of ACK_TEMPLATE and send it from mail-id-2 to the sender
+# within the same thread.
+def format_header(name, value):
+    """Return a single RFC 5322 header line, RFC 2047-encoding the value if it is not ASCII."""
+    value = ' '.join(value.splitlines())
+    if not value.isascii():
+        display_name, address = parseaddr(value) if name == 'To' else ("", "")
+        if address and address.isascii():
+            # Only the display name may be encoded, the address itself must stay as is
+            value = formataddr((display_name, address), charset='utf-8')
+        else:
+            # formataddr cannot encode a non-ASCII address, so encode the whole value as MIMEText did
+            value = Header(value, 'utf-8').encode()
+    return f"{name}: {value}\n"
+
+def is_automated(headers):
+    """Return True if the email, given its lowercased reply headers, was sent by an automated system."""
+    auto_submitted = headers.get('auto-submitted', 'no').strip().lower()
+    precedence = headers.get('precedence', '').strip().lower()
+    return (auto_submitted != 'no' or precedence in AUTOMATED_PRECEDENCE or 'list-id' in headers
+            # Bounces are sent with an empty envelope sender
+            or headers.get('return-path', '').strip() == '<>')
+
+async def send_acknowledgment_reply(gmail_service, creds, full_msg):
+    """Send an acknowledgment reply for an already fetched email; return True once it needs no further handling."""
     # Get headers to identify the sender, subject, and threading information
-    headers = full_msg['payload']['headers']
-    sender_email = next((h['value'] for h in headers if h['name'] == 'From'), "").strip()
-    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
+    # Index the wanted headers case-insensitively in one pass; the first occurrence of a repeated header wins
+    headers = {}
+    # The fields mask omits empty repeated fields, so mail with none of the wanted headers may have no headers at all
+    for header in full_msg.get('payload', {}).get('headers', []):
+        name = header['name'].lower()
+        if name in REPLY_HEADERS and name not in headers:
+            headers[name] = header['value']
+    sender_email = headers.get('from', "").strip()
+    subject = headers.get('subject', "No Subject")
     thread_id = full_msg['threadId']
-    message_id = next((h['value'] for h in headers if h['name'] == 'Message-ID'), None)
+    message_id = headers.get('message-id')
 
     if not sender_email:
         print(f"Warning: No valid sender email found for thread {thread_id}. Skipping send.")
-        return
-
-    # Create the MIME message with threading headers
-    mime_msg = MIMEText(ACKNOWLEDGMENT_MESSAGE)
-    mime_msg['to'] = sender_email
-    mime_msg['subject'] = f"Re: {subject}"
-    # Set threading headers to ensure the reply is part of the same thread
-    if message_id:
-        mime_msg['In-Reply-To'] = message_id
-        mime_msg['References'] = message_id
-
-    # Encode and send the message with threadId
-    raw_msg = base64.urlsafe_b64encode(mime_msg.as_bytes()).decode()
+        return True
+    # Answering auto-responders, mailing lists or bounces could start a reply loop
+    if is_automated(headers):
+        print(f"Skipping automated email from {sender_email} for thread {thread_id}.")
+        return True
+
+    # Prepend the per-reply headers, including threading headers so the reply stays in the same thread
+    try:
+        reply_headers = format_header('To', sender_email) + format_header('Subject', f"Re: {subject}")
+        if message_id:
+            reply_headers += format_header('In-Reply-To', message_id) + format_header('References', message_id)
+        # Encode the message so it can be sent with threadId
+        raw_msg = base64.urlsafe_b64encode(reply_headers.encode() + ACK_TEMPLATE).decode('ascii')
+    except (UnicodeError, ValueError) as e:
+        print(f"Warning: Could not build a reply to {sender_email} for thread {thread_id}: {e}. Skipping send.")
+        return True
+
     body = {'raw': raw_msg, 'threadId': thread_id}
     try:
-        gmail_service.users().messages().send(userId='me', body=body).execute()
+        await execute_async(gmail_service.users().messages().send(userId='me', body=body), creds)
         print(f"Sent threaded acknowledgment from mail-id-2 to {sender_email} for thread {thread_id}")
+        return True
     except HttpError as e:
         print(f"Error sending acknowledgment for thread {thread_id}: {e}")
+        # Only transient failures are left unread for the next poll; a permanent 4xx (e.g. an invalid
+        # To header) would fail the same way every time, so the email is given up on like the skips above
+        return not (is_retryable(e) or e.resp.status >= 500)
 
-# Block 4: Main Function
-# This is the entry point of the script. It authenticates with mail-id-2, fetches unread emails from mail-id-1,
-# sends threaded acknowledgments from mail-id-2, and marks emails as read on mail-id-1.
-def main():
-    """Main execution loop to process unread emails on mail-id-1 and send threaded replies from mail-id-2."""
-    # Authenticate with mail-id-2
-    gmail_service = get_gmail_service()
+# Block 6: Mark As Read Function
+# This function removes the UNREAD label from the given emails on mail-id-1, with one batchModify call
+# per MODIFY_BATCH_SIZE emails.
+async def mark_as_read(gmail_service, creds, msg_ids):
+    """Mark the given emails as read on mail-id-1."""
+    for start in range(0, len(msg_ids), MODIFY_BATCH_SIZE):
+        chunk = msg_ids[start:start + MODIFY_BATCH_SIZE]
+        try:
+            request = gmail_service.users().messages().batchModify(
+                userId='me', body={'ids': chunk, 'removeLabelIds': ['UNREAD']})
+            await execute_async(request, creds)
+            print(f"Marked {len(chunk)} emails as read on mail-id-1.")
+        except HttpError as e:
+            print(f"Error marking emails as read on mail-id-1: {e}")
+
+# Block 7: Process Unread Emails Function
+# This function runs one poll: it fetches unread emails from mail-id-1, sends threaded acknowledgments
+# from mail-id-2, and marks the handled emails as read on mail-id-1.
+async def process_unread_emails(gmail_service, creds, newer_than=None):
+    """Acknowledge every unread email currently on mail-id-1."""
     # Monitor mail-id-1's inbox (requires mail-id-1's delegation or IMAP access setup if not using same credentials)
-    unread_msgs = get_unread_emails(gmail_service)
+    unread_msgs = await get_unread_emails(gmail_service, creds, newer_than)
     print(f"📨 Found {len(unread_msgs)} unread emails on mail-id-1.")
 
-    # Process each unread email
-    for msg in unread_msgs:
-        send_acknowledgment_reply(gmail_service, msg)
+    # Fetch all unread emails up front, then reply to all of them concurrently from the cached payloads
+    fetched = await fetch_messages(gmail_service, creds, unread_msgs)
+    # Exceptions are collected rather than raised, so one failed reply cannot stop the sent ones being marked read
+    results = await asyncio.gather(*[send_acknowledgment_reply(gmail_service, creds, full_msg)
+                                     for full_msg in fetched.values()], return_exceptions=True)
+    processed_ids = []
+    for msg_id, result in zip(fetched, results):
+        if isinstance(result, BaseException):
+            print(f"Error acknowledging email {msg_id} from mail-id-1: {result!r}")
+        elif result:
+            processed_ids.append(msg_id)
+    # Only handled emails are marked as read, so failed sends are retried on the next poll
+    await mark_as_read(gmail_service, creds, processed_ids)
+
+# Block 8: Main Function
+# This is the entry point of the script. It authenticates with mail-id-2 and processes mail-id-1's inbox once;
+# in daemon mode it keeps polling every poll_interval seconds, reusing the same credentials, service and
+# connections between polls.
+async def main(poll_interval=POLL_INTERVAL, daemon=False, newer_than=None):
+    """Main execution loop to process unread emails on mail-id-1 and send threaded replies from mail-id-2."""
+    # Run blocking Gmail calls on a fixed pool sized to the concurrency limit, so each worker thread
+    # owns one long-lived transport instead of the default pool spinning up extra idle ones
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix='gmail'))
+    # Authenticate with mail-id-2
+    creds = get_credentials()
+    gmail_service = get_gmail_service(creds)
+
+    while True:
         try:
-            gmail_service.users().messages().modify(userId='me', id=msg['id'], body={'removeLabelIds': ['UNREAD']}).execute()
-            print(f"Marked email {msg['id']} as read on mail-id-1.")
-        except HttpError as e:
-            print(f"Error marking email {msg['id']} as read on mail-id-1: {e}")
+            await asyncio.to_thread(refresh_credentials, creds)
+            await process_unread_emails(gmail_service, creds, newer_than)
+        except Exception as e:
+            if not daemon:
+                raise
+            # A network blip or failed token refresh only costs this poll; the daemon keeps running
+            print(f"Error polling mail-id-1's inbox, retrying in {poll_interval}s: {e!r}")
+        if not daemon:
+            return
+        await asyncio.sleep(poll_interval)
+
+def positive_int(value):
+    """argparse type for a whole number of seconds of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Acknowledge unread emails on mail-id-1 from mail-id-2.")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and poll the inbox repeatedly (do not combine with cron)")
+    parser.add_argument('--poll-interval', type=positive_int, default=POLL_INTERVAL,
+                        help=f"seconds between inbox polls in daemon mode (default: {POLL_INTERVAL})")
+    parser.add_argument('--newer-than', metavar='WINDOW',
+                        help="only acknowledge unread mail within this Gmail window, e.g. 1d or 12h "
+                             "(default: all unread mail; older unread mail is skipped when set)")
+    args = parser.parse_args()
+    asyncio.run(main(poll_interval=args.poll_interval, daemon=args.daemon, newer_than=args.newer_than))
\ No newline at end of file